@@ -3,12 +3,16 @@ import streamlit as st
 from PIL import Image
 import img2pdf
 import io
+import os
+import shutil
+import tempfile
 import zipfile
+from contextlib import contextmanager
 import cv2
 import numpy as np
 import fitz  # PyMuPDF
-from pypdf import PdfReader, PdfWriter
-import base64
+import pikepdf
+import mozjpeg_lossless_optimization
 
 # Configure page
 st.set_page_config(
@@ -43,67 +47,64 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ===== Helper Functions =====
-def create_download_link(data, filename, text="Download"):
-    b64 = base64.b64encode(data).decode()
-    href = f'<a href="data:application/octet-stream;base64,{b64}" download="{filename}">{text}</a>'
-    return href
+@contextmanager
+def spooled_upload(uploaded_file, suffix=".pdf"):
+    """Copy an upload to a temp file and yield its path, so PDFs are opened from disk, not bytes"""
+    tf = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with tf:
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, tf)
+        yield tf.name
+    finally:
+        os.remove(tf.name)
 
 # ===== PDF to Image with PyMuPDF =====
-def pdf_to_images_pymupdf(pdf_bytes, dpi=200, image_format="PNG"):
-    """Convert PDF to list of images using PyMuPDF"""
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        images = []
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            pix = page.get_pixmap(dpi=dpi)
-            img_bytes = pix.tobytes(image_format.lower())
-            img = Image.open(io.BytesIO(img_bytes))
-            images.append(img)
-        return images
-    except Exception as e:
-        st.error(f"Error converting PDF: {e}")
-        return None
+def pdf_to_images_pymupdf(pdf_path, dpi=200, image_format="PNG"):
+    """Yield (page_index, encoded_bytes) for each PDF page using PyMuPDF"""
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        for page_num, page in enumerate(doc):
+            pix = page.get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csRGB)
+            # MuPDF's encoder, no PIL hop; quality 75 matches Pillow's JPEG default
+            img_bytes = pix.tobytes(image_format.lower(), jpg_quality=75)
+            del pix  # only one page's samples stay resident
+            yield page_num, img_bytes
+
+def render_preview(pdf_path, dpi=72):
+    """Render the first PDF page at low DPI for the on-screen preview"""
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        return doc.load_page(0).get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csRGB).tobytes("png")
 
 # ===== Security Functions =====
-def encrypt_pdf(pdf_bytes, user_password, owner_password=None):
+def encrypt_pdf(pdf_path, user_password, owner_password=None):
     try:
-        pdf_stream = io.BytesIO(pdf_bytes)
-        reader = PdfReader(pdf_stream)
-        writer = PdfWriter()
-        for page in reader.pages:
-            writer.add_page(page)
-        writer.encrypt(
-            user_password=user_password,
-            owner_password=owner_password or user_password,
-            algorithm="AES-256"
-        )
+        # st.download_button takes the BytesIO as-is; no getvalue()/read() copy here
         output = io.BytesIO()
-        writer.write(output)
-        output.seek(0)
-        return output.read()
+        with pikepdf.open(pdf_path) as pdf:
+            pdf.save(output, encryption=pikepdf.Encryption(
+                user=user_password,
+                owner=owner_password or user_password,
+                R=6  # AES-256
+            ))
+        return output
     except Exception as e:
         st.error(f"Encryption error: {e}")
         return None
 
-def decrypt_pdf(encrypted_pdf_bytes, password):
+def decrypt_pdf(encrypted_pdf_path, password):
     try:
-        reader = PdfReader(io.BytesIO(encrypted_pdf_bytes))
-        if reader.is_encrypted:
-            if reader.decrypt(password):
-                writer = PdfWriter()
-                for page in reader.pages:
-                    writer.add_page(page)
-                output = io.BytesIO()
-                writer.write(output)
-                output.seek(0)
-                return output.read()
+        with pikepdf.open(encrypted_pdf_path, password=password) as pdf:
+            output = io.BytesIO()
+            if pdf.is_encrypted:
+                pdf.save(output, encryption=False)
             else:
-                st.error("Incorrect password")
-                return None
-        else:
-            st.info("PDF is not encrypted")
-            return encrypted_pdf_bytes
+                st.info("PDF is not encrypted")
+                with open(encrypted_pdf_path, "rb") as f:
+                    shutil.copyfileobj(f, output)
+            return output
+    except pikepdf.PasswordError:
+        st.error("Incorrect password")
+        return None
     except Exception as e:
         st.error(f"Decryption error: {e}")
         return None
@@ -111,8 +112,17 @@ def decrypt_pdf(encrypted_pdf_bytes, password):
 # ===== Image Processing =====
 def resize_image(image_file, width, height):
     try:
-        img = Image.open(image_file)
-        resized_img = img.resize((width, height), Image.Resampling.LANCZOS)
+        img = image_file if isinstance(image_file, Image.Image) else Image.open(image_file)
+        if img.mode in ("RGB", "L"):
+            # OpenCV's SIMD kernels; INTER_AREA avoids the aliasing LANCZOS4 shows when shrinking
+            shrinking = width < img.width or height < img.height
+            interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+            arr = cv2.resize(np.asarray(img), (width, height), interpolation=interpolation)
+            resized_img = Image.fromarray(arr)
+            resized_img.info = img.info.copy()  # keep ICC profile, tRNS, dpi like Image.resize
+        else:
+            # Alpha, palette and high bit-depth modes keep Pillow's resampler
+            resized_img = img.resize((width, height), Image.Resampling.LANCZOS)
         img_byte_arr = io.BytesIO()
         img_format = img.format if img.format else 'PNG'
         resized_img.save(img_byte_arr, format=img_format)
@@ -129,24 +139,63 @@ def compress_image(image_file, quality=85):
             img = img.convert("RGB")
         img_byte_arr = io.BytesIO()
         img.save(img_byte_arr, format="JPEG", quality=quality, optimize=True)
-        img_byte_arr.seek(0)
-        return img_byte_arr.getvalue()
+        # Lossless mozjpeg pass (progressive scans) shrinks the file without touching pixels
+        return mozjpeg_lossless_optimization.optimize(img_byte_arr.getvalue())
     except Exception as e:
         st.error(f"Compression error: {e}")
         return None
 
+# ===== Page Layouts =====
+# Layouts are built once at import and shared by every conversion
+PAGE_LAYOUTS = {
+    "Original": img2pdf.default_layout_fun,
+    "A4": img2pdf.get_layout_fun((img2pdf.mm_to_pt(210), img2pdf.mm_to_pt(297))),
+    "Letter": img2pdf.get_layout_fun((img2pdf.in_to_pt(8.5), img2pdf.in_to_pt(11))),
+}
+
 # ===== FIXED Images to PDF (handles invalid EXIF rotation) =====
-def images_to_pdf_conversion(image_files):
+def _normalize_to_jpeg(img_file):
+    img_file.seek(0)
+    img = Image.open(img_file)
+    rgb_img = img.convert("RGB")  # normalize mode
+    temp_io = io.BytesIO()
+    rgb_img.save(temp_io, format="JPEG")
+    temp_io.seek(0)
+    return temp_io.read()
+
+def _img2pdf_accepts(jpeg_bytes):
+    try:
+        img2pdf.convert(jpeg_bytes, rotation=img2pdf.Rotation.ifvalid)
+        return True
+    except Exception:
+        return False
+
+def images_to_pdf_conversion(image_files, page_size="Original"):
     try:
         pil_images = []
+        passthrough = []
         for img_file in image_files:
-            img = Image.open(img_file)
-            rgb_img = img.convert("RGB")  # normalize mode
-            temp_io = io.BytesIO()
-            rgb_img.save(temp_io, format="JPEG")
-            temp_io.seek(0)
-            pil_images.append(temp_io.read())
-        pdf_bytes = img2pdf.convert(pil_images, rotation=img2pdf.Rotation.ifvalid)
+            img_file.seek(0)
+            is_jpeg = img_file.read(3) == b'\xff\xd8\xff'
+            img_file.seek(0)
+            if is_jpeg:
+                # img2pdf embeds JPEG streams losslessly; skip the decode/re-encode
+                passthrough.append(len(pil_images))
+                pil_images.append(img_file.read())
+            else:
+                pil_images.append(_normalize_to_jpeg(img_file))
+        try:
+            pdf_bytes = img2pdf.convert(pil_images, layout_fun=PAGE_LAYOUTS[page_size],
+                                        rotation=img2pdf.Rotation.ifvalid)
+        except Exception:
+            # Re-encode only the passed-through JPEGs img2pdf rejects, then retry the batch
+            rejected = [i for i in passthrough if not _img2pdf_accepts(pil_images[i])]
+            if not rejected:
+                raise  # the failure came from elsewhere; a retry would fail the same way
+            for i in rejected:
+                pil_images[i] = _normalize_to_jpeg(image_files[i])
+            pdf_bytes = img2pdf.convert(pil_images, layout_fun=PAGE_LAYOUTS[page_size],
+                                        rotation=img2pdf.Rotation.ifvalid)
         return pdf_bytes
     except Exception as e:
         st.error(f"Error creating PDF: {e}")
@@ -164,6 +213,9 @@ def main():
          "🗜️ Compress Images", "🔒 PDF Security"]
     )
 
+    if operation != "📏 Resize Images":
+        clear_resize_cache()
+
     if operation == "📄 PDF to Images":
         pdf_to_images_interface()
     elif operation == "🖼️ Images to PDF":
@@ -183,27 +235,36 @@ def pdf_to_images_interface():
     if uploaded_file is not None:
         col1, col2 = st.columns(2)
         with col1:
-            st.info(f"File size: {len(uploaded_file.getvalue()) / 1024:.1f} KB")
+            st.info(f"File size: {uploaded_file.size / 1024:.1f} KB")
             image_format = st.selectbox("Output format", ["PNG", "JPEG"])
         with col2:
             dpi = st.slider("Image quality (DPI)", 72, 300, 200)
 
         if st.button("Convert to Images", type="primary"):
             with st.spinner("Converting PDF to images..."):
-                images = pdf_to_images_pymupdf(uploaded_file.read(), dpi=dpi, image_format=image_format)
-                if images:
-                    st.success(f"✅ Converted {len(images)} pages successfully!")
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                        for i, img in enumerate(images):
-                            img_buffer = io.BytesIO()
-                            img.save(img_buffer, format=image_format)
-                            zip_file.writestr(f"page_{i+1}.{image_format.lower()}", img_buffer.getvalue())
+                zip_buffer = io.BytesIO()
+                page_count = 0
+                try:
+                    with spooled_upload(uploaded_file) as pdf_path:
+                        # The preview is shown 400px wide; don't pay full-DPI work for it
+                        preview = render_preview(pdf_path)
+                        # PNG/JPEG already compressed; deflating them again only costs CPU
+                        with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_STORED,
+                                             allowZip64=True) as zip_file:
+                            pages = pdf_to_images_pymupdf(pdf_path, dpi=dpi, image_format=image_format)
+                            for i, img_bytes in pages:
+                                zip_file.writestr(f"page_{i+1}.{image_format.lower()}", img_bytes)
+                                page_count += 1
+                except Exception as e:
+                    st.error(f"Error converting PDF: {e}")
+                    page_count = 0
+                if page_count:
+                    st.success(f"✅ Converted {page_count} pages successfully!")
                     st.subheader("Preview (First Page)")
-                    st.image(images[0], caption="Page 1", width=400)
+                    st.image(preview, caption="Page 1", width=400)
                     st.download_button(
                         label="📥 Download Images (ZIP)",
-                        data=zip_buffer.getvalue(),
+                        data=zip_buffer,
                         file_name=f"converted_images_{image_format.lower()}.zip",
                         mime="application/zip"
                     )
@@ -214,9 +275,10 @@ def images_to_pdf_interface():
         type=["png", "jpg", "jpeg", "bmp", "tiff"], accept_multiple_files=True)
     if uploaded_files:
         st.info(f"Selected {len(uploaded_files)} images")
+        page_size = st.selectbox("Page size", list(PAGE_LAYOUTS))
         if st.button("Convert to PDF", type="primary"):
             with st.spinner("Creating PDF..."):
-                pdf_bytes = images_to_pdf_conversion(uploaded_files)
+                pdf_bytes = images_to_pdf_conversion(uploaded_files, page_size=page_size)
                 if pdf_bytes:
                     st.success("✅ PDF created successfully!")
                     st.download_button(
@@ -226,16 +288,27 @@ def images_to_pdf_interface():
                         mime="application/pdf"
                     )
 
+def clear_resize_cache():
+    """Drop the decoded resize input so it isn't pinned in the session"""
+    st.session_state.pop("resize_file_id", None)
+    st.session_state.pop("resize_img", None)
+
 def resize_images_interface():
     st.header("📏 Image Resizer")
     uploaded_file = st.file_uploader("Choose image", type=["png", "jpg", "jpeg", "bmp"])
-    if uploaded_file is not None:
-        img = Image.open(uploaded_file)
+    if uploaded_file is None:
+        clear_resize_cache()
+    else:
+        # Reruns on every widget change; only open the image when a new file is uploaded
+        if st.session_state.get("resize_file_id") != uploaded_file.file_id:
+            st.session_state.resize_file_id = uploaded_file.file_id
+            st.session_state.resize_img = Image.open(uploaded_file)
+        img = st.session_state.resize_img
         orig_width, orig_height = img.size
         new_width = st.number_input("Width", value=orig_width)
         new_height = st.number_input("Height", value=orig_height)
         if st.button("Resize Image", type="primary"):
-            resized_data, img_format = resize_image(uploaded_file, new_width, new_height)
+            resized_data, img_format = resize_image(img, new_width, new_height)
             if resized_data:
                 st.image(resized_data, caption=f"Resized {new_width}x{new_height}")
                 st.download_button(
@@ -269,13 +342,23 @@ def security_interface():
         if security_operation == "Encrypt PDF":
             user_password = st.text_input("User Password", type="password")
             if st.button("Encrypt PDF") and user_password:
-                encrypted_pdf = encrypt_pdf(uploaded_file.read(), user_password)
+                try:
+                    with spooled_upload(uploaded_file) as pdf_path:
+                        encrypted_pdf = encrypt_pdf(pdf_path, user_password)
+                except Exception as e:
+                    st.error(f"Encryption error: {e}")
+                    encrypted_pdf = None
                 if encrypted_pdf:
                     st.download_button("📥 Download Encrypted PDF", encrypted_pdf, "encrypted.pdf")
         elif security_operation == "Decrypt PDF":
             password = st.text_input("Enter Password", type="password")
             if st.button("Decrypt PDF") and password:
-                decrypted_pdf = decrypt_pdf(uploaded_file.read(), password)
+                try:
+                    with spooled_upload(uploaded_file) as pdf_path:
+                        decrypted_pdf = decrypt_pdf(pdf_path, password)
+                except Exception as e:
+                    st.error(f"Decryption error: {e}")
+                    decrypted_pdf = None
                 if decrypted_pdf:
                     st.download_button("📥 Download Decrypted PDF", decrypted_pdf, "decrypted.pdf")
 